@@ -1,21 +1,42 @@
 """Use py3Dmol to display a pose in a Jupyter notebook."""
 from typing import Optional, Dict
+import weakref
 import py3Dmol
-import tempfile
+from pyrosetta.rosetta.core.io.pdb import dump_pdb
+from pyrosetta.rosetta.std import ostringstream
 
 
 def pdb_string_from_pose(input_pose):
-    with tempfile.NamedTemporaryFile(suffix='.pdb', delete=True) as temp_file:
-        temp_file_path = temp_file.name
-
-        input_pose.dump_pdb(temp_file_path)
-
-        with open(temp_file_path, 'r') as f:
-            return f.read()
-
-def display_pose(input_pose, show=True, show_axes=True, residue_colors : Optional[Dict] = None):
-    """Display a pose in a Jupyter notebook using py3Dmol."""
-    pdb_str = pdb_string_from_pose(input_pose)
+    """Render a pose as a PDB formatted string without touching the filesystem."""
+    buffer = ostringstream()
+    dump_pdb(input_pose, buffer)
+    return buffer.str()
+
+
+# PDB strings rendered with reuse_pdb set, dropped when the pose is garbage collected
+_pdb_string_cache = weakref.WeakKeyDictionary()
+
+
+def display_pose(
+    input_pose,
+    show=True,
+    show_axes=True,
+    residue_colors : Optional[Dict] = None,
+    reuse_pdb=False,
+):
+    """Display a pose in a Jupyter notebook using py3Dmol.
+
+    Set reuse_pdb to keep the rendered PDB string and reuse it the next time the same pose is
+    displayed with reuse_pdb set, e.g. to try different residue_colors. Only do this when the
+    pose has not changed since it was last displayed.
+    """
+    if reuse_pdb:
+        pdb_str = _pdb_string_cache.get(input_pose)
+        if pdb_str is None:
+            pdb_str = pdb_string_from_pose(input_pose)
+            _pdb_string_cache[input_pose] = pdb_str
+    else:
+        pdb_str = pdb_string_from_pose(input_pose)
 
     view = py3Dmol.view(width=500, height=500)
     view.addModel(pdb_str, "pdb")
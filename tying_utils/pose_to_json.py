@@ -6,48 +6,90 @@ import numpy as np
 from pyrosetta import Pose, pose_from_pdb
 from pyrosetta.rosetta.core.pose import append_pose_to_pose
 
-from rprotein_utils.rfdiffusion_utils import split_chains_by_residue_distance
-
 DEFAULT_DESIRED_ATOMS = ['N', 'CA', 'C', 'O']
 
 CHAIN_NAMES = 'ABCDEFGHIJ'
 
+def walk_pose(pose: Pose):
+    """Yield (residue_index, residue, chain_name, name1) for each residue in the pose.
+
+    Each residue is fetched from the pose exactly once so callers that need several
+    per-residue values can share a single traversal.
+    """
+    for residue_index in range(1, pose.total_residue()+1):
+        residue = pose.residue(residue_index)
+        yield residue_index, residue, CHAIN_NAMES[residue.chain()-1], residue.name1()
+
+
 def get_full_sequence_from_pose( pose: Pose):
-    return ''.join([
-        pose.residue(i).name1()
-        for i in range(1, pose.total_residue()+1)
-    ])
+    sequence = bytearray(pose.total_residue())
+    residue = pose.residue
+    for i in range(len(sequence)):
+        sequence[i] = ord(residue(i+1).name1())
+
+    return sequence.decode('ascii')
 
 
 def get_pose_details_by_chain(input_pose, desired_atoms=DEFAULT_DESIRED_ATOMS):
-    chains = {}
+    _, chains = _get_sequence_and_details_by_chain(input_pose, desired_atoms)
+    return chains
 
-    for residue_index in range(1, input_pose.total_residue()+1):
-        residue = input_pose.residue(residue_index)
 
-        chain_num = residue.chain()
-        chain_name = CHAIN_NAMES[chain_num-1]
-        if chain_name not in chains:
-            chains[chain_name] = {
-                'xyz': {},
-                'sequence': ''
-            }
+def _get_sequence_and_details_by_chain(input_pose, desired_atoms=DEFAULT_DESIRED_ATOMS):
+    """Return the full sequence and the per chain details of a pose from a single traversal."""
+    total_residues = input_pose.total_residue()
 
-        chains[chain_name]['sequence'] += residue.name1()
+    # Gather coordinates for every residue into a single (residues, atoms, xyz) array
+    # float64 so the values match the Rosetta coordinates exactly once converted to lists
+    coords = np.empty((total_residues, len(desired_atoms), 3), dtype=np.float64)
+    chain_names = []
+    sequence = []
 
+    # Atom indexes only depend on the residue type so look them up once per type
+    atom_indexes_by_residue_type = {}
 
-        for desired_atom in desired_atoms:
-            atom_chain_name = f'{desired_atom}_chain_{chain_name}'
+    for residue_index, residue, chain_name, name1 in walk_pose(input_pose):
+        i = residue_index - 1
 
-            atom = residue.atom(desired_atom)
-            x,y,z = atom.xyz()
+        chain_names.append(chain_name)
+        sequence.append(name1)
 
-            if atom_chain_name not in chains[chain_name]['xyz']:
-                chains[chain_name]['xyz'][atom_chain_name] = []
+        residue_type_name = residue.name()
+        atom_indexes = atom_indexes_by_residue_type.get(residue_type_name)
+        if atom_indexes is None:
+            atom_indexes = [
+                residue.atom_index(desired_atom)
+                for desired_atom in desired_atoms
+            ]
+            atom_indexes_by_residue_type[residue_type_name] = atom_indexes
 
-            chains[chain_name]['xyz'][atom_chain_name].append([x,y,z])
+        # Write the whole (atoms, xyz) row for the residue at once
+        xyz = residue.xyz
+        coords[i] = [tuple(xyz(atom_index)) for atom_index in atom_indexes]
 
-    return chains
+    chain_ids = np.array(chain_names)
+
+    chains = {}
+    for chain_name in dict.fromkeys(chain_names):
+        chain_residue_indexes = np.where(chain_ids == chain_name)[0]
+        # (atoms, residues, xyz) so each atom's coordinates can be taken with a single index
+        chain_coords = coords[chain_residue_indexes].transpose(1, 0, 2)
+
+        # Atom keys are only built once per chain
+        atom_chain_keys = [
+            f'{desired_atom}_chain_{chain_name}'
+            for desired_atom in desired_atoms
+        ]
+
+        chains[chain_name] = {
+            'xyz': {
+                atom_chain_key: chain_coords[a].tolist()
+                for a, atom_chain_key in enumerate(atom_chain_keys)
+            },
+            'sequence': ''.join(sequence[j] for j in chain_residue_indexes)
+        }
+
+    return ''.join(sequence), chains
 
 
 def make_protein_mpnn_pdb_input(pose_name, pose : Pose) -> Dict:
@@ -63,11 +105,10 @@ def make_protein_mpnn_pdb_input(pose_name, pose : Pose) -> Dict:
         'num_of_chains': int,                               # The number of chains in the pose
         'seq': str,                                         # The full sequence of all chains in the pose
         'seq_chain_<chain_name>': str,                      # The sequence of each chain
-        'coords_chain_<chain_name>': list[np.array[3,1]]    # The coordinates of each chain
+        'coords_chain_<chain_name>': dict[str, list[list[float]]]   # [x, y, z] per residue, keyed by '<atom>_chain_<chain_name>'
     }
     """
-    full_sequence = get_full_sequence_from_pose( pose )
-    pose_details = get_pose_details_by_chain(pose)
+    full_sequence, pose_details = _get_sequence_and_details_by_chain(pose)
 
     pose_record = {
         'name': pose_name,
@@ -1,5 +1,16 @@
-from typing import Dict
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+import multiprocessing
+import os
+from typing import Dict, List, Optional, Tuple
+import numpy as np
+import pyrosetta
 from pyrosetta import Pose, pose_from_pdb
+from pyrosetta.rosetta.protocols.grafting import return_region
+
+from tying_utils.pose_to_json import get_full_sequence_from_pose
+
+CHAIN_NAMES = 'ABCDEFGHIJKLMNOPQRSTUVWXYZ'
 
 
 def split_chains_by_residue_distance(input_pose) -> Dict[str, Pose]:
@@ -13,84 +24,152 @@ def split_chains_by_residue_distance(input_pose) -> Dict[str, Pose]:
         Includes an additional key 'all' for the combined pose with all residues.
     """
 
-    all_residue_pose = Pose()
+    return _chain_poses_from_bounds(input_pose, find_chain_bounds(input_pose))
 
-    chain_poses = {}
-    chain_names = 'ABCDEFGHIJKLMNOPQRSTUVWXYZ'
-    cur_chain_index = 0
-    cur_chain_pose = Pose()
 
-    for residue_index in range(1, input_pose.total_residue()):
-        r1 = input_pose.residue(residue_index)
-        r2 = input_pose.residue(residue_index+1)
-
-        cur_chain_pose.append_residue_by_jump(r1, cur_chain_pose.size())
+def find_chain_bounds(input_pose) -> List[Tuple[int, int]]:
+    """Return the 0-relative, end exclusive (start, end) residue bounds of each chain in a pose
+    output by rfdiffusion, using the same CA distance rule as split_chains_by_residue_distance.
+    """
+    total_residues = input_pose.total_residue()
+    if total_residues == 0:
+        raise ValueError("Cannot split chains of a pose with no residues")
 
-        all_residue_pose.append_residue_by_jump(
-            r1, all_residue_pose.size())
+    # Pull all of the CA coordinates into a single array so that the distances between
+    # consecutive residues can be computed in bulk
+    ca = np.empty((total_residues, 3), dtype=np.float32)
+    residue = input_pose.residue
+    for i in range(total_residues):
+        ca_xyz = residue(i+1).xyz('CA')
+        ca[i, :] = (ca_xyz.x, ca_xyz.y, ca_xyz.z)
 
+    diff = ca[1:] - ca[:-1]
+    distances = np.sqrt(np.einsum('ij,ij->i', diff, diff))
 
-        # If we have reached the last residue, we don't need to calculate the distance
-        # to the next residue
-        if residue_index == input_pose.total_residue():
-            continue
+    for i in np.where(distances > 4)[0]:
+        print('>4: ', distances[i], i+2, i+3)
 
-        ca1 = r1.xyz('CA')
-        ca2 = r2.xyz('CA')
-        distance = ca1.distance(ca2)
+    # If the next residue is more than 10 Angstroms away from the previous,
+    # we start a new chain. Breaks are the 0-relative index of the first residue of each new chain.
+    breaks = np.flatnonzero(distances > 10) + 1
 
-        if distance > 4:
-            print('>4: ',distance, residue_index+1, residue_index+2)
+    # The last chain runs from the final break to the end of the pose so every residue,
+    # including the last one, lands in exactly one chain
+    chain_bounds = [0] + breaks.tolist() + [total_residues]
+    return list(zip(chain_bounds[:-1], chain_bounds[1:]))
 
-        # If the 2nd residue is more than 10 Angstroms away from the 1st,
-        # we start a new chain
-        if distance > 10:
-            #print('BIGGY', distance)
-            #print(distance, residue_index+1, residue_index+2)
 
-            chain_poses[chain_names[cur_chain_index]] = cur_chain_pose
-            cur_chain_index += 1
-            cur_chain_pose = Pose()
+def _chain_poses_from_bounds(input_pose, chain_bounds: List[Tuple[int, int]]) -> Dict[str, Pose]:
+    """Slice a pose into chain poses given the 0-relative, end exclusive bounds of each chain."""
+    chain_poses = {}
 
-    # Append the last residue!
-    cur_chain_pose.append_residue_by_jump(r2, cur_chain_pose.size())
-    all_residue_pose.append_residue_by_jump(
-        r2, all_residue_pose.size())
+    for chain_index, (start, end) in enumerate(chain_bounds):
+        # return_region expects 1-relative, inclusive residue positions
+        chain_poses[CHAIN_NAMES[chain_index]] = return_region(input_pose, start+1, end)
 
-    chain_poses[chain_names[cur_chain_index]] = cur_chain_pose
-    chain_poses['all'] = all_residue_pose
+    chain_poses['all'] = input_pose.clone()
     return chain_poses
 
 
+# Maximum number of parsed PDB files kept by get_name_and_sequence_from_pdb
+PDB_CACHE_SIZE = 16
+
+_parsed_pdb_cache = OrderedDict()
+
+
+def clear_pdb_cache():
+    """Drop all parsed PDB files cached by get_name_and_sequence_from_pdb."""
+    _parsed_pdb_cache.clear()
+
+
 #def get_design_name_and_sequence_from_rf_diffusion_output(pdb_dir_path: str) -> List
 def get_name_and_sequence_from_pdb(pdb_path: str) -> Dict[str, str]:
     """Given a PDB path, extract the design name and sequence from the PDB file.
 
     The design name is extracted from the filename, and the sequence is extracted from the PDB file.
+
+    The last PDB_CACHE_SIZE parsed files are cached by path, modification time and size so
+    repeated calls for an unchanged file skip parsing. Chain poses are sliced from the cached
+    pose on every call so callers can modify them.
     """
+    stat = os.stat(pdb_path)
+    cache_key = (pdb_path, stat.st_mtime_ns, stat.st_size)
+
+    if cache_key in _parsed_pdb_cache:
+        _parsed_pdb_cache.move_to_end(cache_key)
+        rfdiffusion_output_pose, record = _parsed_pdb_cache[cache_key]
+    else:
+        rfdiffusion_output_pose, record = _parse_pdb(pdb_path)
+
+        if PDB_CACHE_SIZE > 0:
+            _parsed_pdb_cache[cache_key] = (rfdiffusion_output_pose, record)
+            while len(_parsed_pdb_cache) > PDB_CACHE_SIZE:
+                _parsed_pdb_cache.popitem(last=False)
+
+    chains_poses = _chain_poses_from_bounds(rfdiffusion_output_pose, record['chain_bounds'])
+
+    print(chains_poses)
+
+    return {
+        'design_name': record['design_name'],
+        'chain_sequences': dict(record['chain_sequences']),
+        'chain_poses': chains_poses,
+    }
+
+
+def _parse_pdb(pdb_path: str) -> Tuple[Pose, Dict]:
+    """Load a PDB file and find its design name, chain bounds and chain sequences."""
     design_num = pdb_path.split('/')[-1][:-4].replace('_', '')
     design_name = f'D{design_num}'
 
     rfdiffusion_output_pose = pose_from_pdb(pdb_path)
 
-    chains_poses = split_chains_by_residue_distance(rfdiffusion_output_pose)
+    chain_bounds = find_chain_bounds(rfdiffusion_output_pose)
 
-    print(chains_poses)
+    full_sequence = get_full_sequence_from_pose(rfdiffusion_output_pose)
 
-    sequences = {}
-    for chain_name, chain_pose in chains_poses.items():
-        if chain_name == 'all':
-            continue
+    # Chains are consecutive slices of the input pose so slice their sequences from the full sequence
+    sequences = {
+        CHAIN_NAMES[chain_index]: full_sequence[start:end]
+        for chain_index, (start, end) in enumerate(chain_bounds)
+    }
 
-        chain_sequence = ''.join([
-            chain_pose.residue(i).name1()
-            for i in range(1, chain_pose.total_residue() + 1)
-        ])
-        sequences[chain_name] = chain_sequence
+    return rfdiffusion_output_pose, {
+        'design_name': design_name,
+        'chain_bounds': chain_bounds,
+        'chain_sequences': sequences,
+    }
+
+
+def batch_pdbs_to_records(
+    pdb_paths: List[str],
+    n_workers: Optional[int] = None,
+    pyrosetta_init_options: Optional[str] = None,
+) -> List[Dict]:
+    """Find the design name and chain sequences of many PDB files in parallel.
 
+    PyRosetta holds the GIL while parsing, so each file is parsed in a separate process.
+    Workers are always spawned and call pyrosetta.init(pyrosetta_init_options) before
+    parsing, so pass the same options the calling process was initialized with. If it is
+    None, workers use PyRosetta's default options.
 
+    Only the picklable 'design_name' and 'chain_sequences' are returned, in the same
+    order as pdb_paths. Use get_name_and_sequence_from_pdb when the chain poses are needed.
+    Parsed files are not added to the PDB cache.
+    """
+    with ProcessPoolExecutor(
+        max_workers=n_workers,
+        mp_context=multiprocessing.get_context('spawn'),
+        initializer=pyrosetta.init,
+        initargs=() if pyrosetta_init_options is None else (pyrosetta_init_options,),
+    ) as executor:
+        return list(executor.map(_get_name_and_sequences_from_pdb, pdb_paths))
+
+
+def _get_name_and_sequences_from_pdb(pdb_path: str) -> Dict:
+    """Process pool worker for batch_pdbs_to_records."""
+    _, record = _parse_pdb(pdb_path)
     return {
-        'design_name': design_name,
-        'chain_sequences': sequences,
-        'chain_poses': chains_poses,
+        'design_name': record['design_name'],
+        'chain_sequences': record['chain_sequences'],
     }
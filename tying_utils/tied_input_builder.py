@@ -1,6 +1,6 @@
 import os
-import json
 from typing import Dict, List, Tuple
+import orjson
 from pyrosetta import Pose
 
 class ProteinMPNNInputFileBuilder:
@@ -14,19 +14,40 @@ class ProteinMPNNInputFileBuilder:
     - tied_pdbs.jsonl - a dictionary of tied residues by chain.
     - fixed_pdbs.jsonl - a dictionary of fixed residues by chain.
 
+    Parsed pdbs are appended to parsed_pdbs.jsonl as they are added rather than
+    held in memory, so the builder should be closed (or used as a context manager)
+    when done. Parsed pdbs that were never stored can be added again when the
+    directory is loaded again.
+
     """
 
     def __init__(self, output_dir_path : str):
         self.output_dir_path = output_dir_path
 
         self._existing_pdb_names = set()
-        self._added_pdbs = []
+        self._all_tied_records = {}
+        self._all_fixed_records = {}
 
         if not os.path.exists(self.output_dir_path):
             os.makedirs(self.output_dir_path)
         else:
             self.load_existing_records()
 
+        self._parsed_pdb_file = open(self.output_parsed_pdb_path, 'ab')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        """Store the tied and fixed records and close the parsed pdb file."""
+        if self._parsed_pdb_file.closed:
+            return
+
+        self.store()
+        self._parsed_pdb_file.close()
 
     @property
     def tied_output_file_path(self):
@@ -48,32 +69,36 @@ class ProteinMPNNInputFileBuilder:
         self._all_fixed_records = load_and_merge_existing_json_records(
             self.fixed_output_file_path)
 
+        # Parsed pdbs are written as they are added while the tied records are only written
+        # by store(). If there are tied records, a parsed pdb without one was never stored
+        # and is not counted as existing so it can be added again.
+        has_tied_records = bool(self._all_tied_records)
         try:
-            with open(self.output_parsed_pdb_path, 'r') as f:
-                for line in f.readlines():
-                    if line.strip() == '':
+            with open(self.output_parsed_pdb_path, 'rb') as f:
+                for line in f:
+                    if not line.strip():
                         continue
 
-                    parsed_pdb = json.loads(line)
-                    self._existing_pdb_names.add(parsed_pdb['name'])
+                    parsed_pdb = orjson.loads(line)
+                    if not has_tied_records or parsed_pdb['name'] in self._all_tied_records:
+                        self._existing_pdb_names.add(parsed_pdb['name'])
         except FileNotFoundError:
             pass
 
 
     def store(self):
         """Store the tied and fixed records to the appropriate files."""
-        with open(self.tied_output_file_path, 'w+') as f:
-            f.write(json.dumps(self._all_tied_records) + '\n')
-
-        with open(self.fixed_output_file_path, 'w+') as f:
-            f.write(json.dumps(self._all_fixed_records) + '\n')
+        # Parsed pdbs are written as they are added, make sure they have reached the disk
+        # before any tied record refers to them
+        if not self._parsed_pdb_file.closed:
+            self._parsed_pdb_file.flush()
+            os.fsync(self._parsed_pdb_file.fileno())
 
-        with open(self.output_parsed_pdb_path, 'a+') as f:
-            for parsed_pdb in self._added_pdbs:
-                f.write(json.dumps(parsed_pdb) + '\n')
+        with open(self.tied_output_file_path, 'wb') as f:
+            f.write(orjson.dumps(self._all_tied_records, option=orjson.OPT_SERIALIZE_NUMPY) + b'\n')
 
-            # Clear the added pdbs after writing to file
-            self._added_pdbs = []
+        with open(self.fixed_output_file_path, 'wb') as f:
+            f.write(orjson.dumps(self._all_fixed_records, option=orjson.OPT_SERIALIZE_NUMPY) + b'\n')
 
 
     def add_tied_and_fixed_pdb(
@@ -88,22 +113,30 @@ class ProteinMPNNInputFileBuilder:
         if pdb_name in self._existing_pdb_names:
             raise ValueError(f"PDB {pdb_name} already exists in records!")
 
+        # ProteinMPNN matches tied and fixed records to parsed pdbs by name
+        if parsed_pdb['name'] != pdb_name:
+            raise ValueError(
+                f"PDB name {pdb_name} does not match parsed pdb name {parsed_pdb['name']}!")
+
+        # Serialize before recording anything so nothing is recorded if it fails
+        parsed_pdb_line = orjson.dumps(parsed_pdb, option=orjson.OPT_SERIALIZE_NUMPY) + b'\n'
+        self._parsed_pdb_file.write(parsed_pdb_line)
+
         self._all_tied_records[pdb_name] = tied_residues_by_chain
         self._all_fixed_records[pdb_name] = fixed_residues_by_chain
-
-        self._added_pdbs.append(parsed_pdb)
+        self._existing_pdb_names.add(pdb_name)
 
 
 def load_and_merge_existing_json_records( jsonl_path: str) -> Dict:
     """Load existing json records from a jsonl file and merge them into a single dictionary."""
     all_existing_records = {}
     try:
-        with open(jsonl_path, 'r') as f:
-            for line in f.readlines():
-                if line.strip() == '':
+        with open(jsonl_path, 'rb') as f:
+            for line in f:
+                if not line.strip():
                     continue
 
-                existing_records = json.loads(line)
+                existing_records = orjson.loads(line)
                 all_existing_records.update(existing_records)
     except FileNotFoundError:
         pass
@@ -159,18 +192,22 @@ def create_fixed_and_tied_residue_sets(
     #print('TOTAL COMBINED LENGTH', combined_pose.total_residue())
 
     # Calulate the length of each chain
+    # chain_endings holds the last residue of every chain except the final one
+    chain_endings = list(combined_pose.conformation().chain_endings())
+    total_residues = combined_pose.total_residue()
+    if total_residues > (chain_endings[-1] if chain_endings else 0):
+        chain_endings.append(total_residues)
+
     chain_lengths = {}
     chain_starts = {}
-    for i in range(1, combined_pose.total_residue()+1):
-
-        chain = combined_pose.residue(i).chain()
-        chain_name = CHAIN_NAMES[chain-1]
+    previous_chain_end = 0
+    for chain_index, chain_end in enumerate(chain_endings):
+        chain_name = CHAIN_NAMES[chain_index]
 
-        if chain_name not in chain_lengths:
-            chain_lengths[chain_name] = 0
-            chain_starts[chain_name] = i
+        chain_starts[chain_name] = previous_chain_end + 1
+        chain_lengths[chain_name] = chain_end - previous_chain_end
 
-        chain_lengths[chain_name] += 1
+        previous_chain_end = chain_end
 
 
 
@@ -185,22 +222,18 @@ def create_fixed_and_tied_residue_sets(
             raise ValueError(f"Invalid chain names: {chain_1}, {chain_2}")
 
         total_chain_residue_len = chain_lengths[chain_1]
-        chain_start_pos = chain_starts[chain_1]
 
         assert total_chain_residue_len == chain_lengths[chain_2], f"Chains {chain_1} ({total_chain_residue_len}) and {chain_2} ({chain_lengths[chain_2]}) must have the same length"
 
-        for i in range(1, total_chain_residue_len + 1):
-
-            # Input is a residue position of original design where residue indexes are all 1-relative to start of pose
-            chain_pos = i + chain_start_pos
-
-            #if chain_pos in designed_residue_set:
-            #    continue
-
-            tied_residues_by_chain.append({
+        # Residue positions are 1-relative to the start of each chain. To skip designed residues,
+        # filter on the pose position chain_starts[chain_1] + i - 1 against designed_residues_set.
+        tied_residues_by_chain.extend(
+            {
                 chain_1: [[i], [weight]],
                 chain_2: [[i], [weight]]
-            })
+            }
+            for i in range(1, total_chain_residue_len + 1)
+        )
 
     #designed_residues_set = set(designed_residues)
 
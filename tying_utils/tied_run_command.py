@@ -1,3 +1,7 @@
+import shlex
+from typing import List
+
+
 def create_protein_mpnn_run_command(
     protein_mpnn_install_dir_path : str,
     input_dir_path : str,
@@ -7,8 +11,12 @@ def create_protein_mpnn_run_command(
     batch_size : int = 1,
     seed : int = None,
     python_cmd_or_path : str = 'python'
-):
-    """Create the shell command to run ProteinMPNN."""
+) -> List[str]:
+    """Create the command to run ProteinMPNN as a list of arguments.
+
+    The list can be passed directly to subprocess.run. Use as_shell_string to get a
+    quoted string for a shell.
+    """
 
     protein_mpnn_args = {
         'jsonl_path': f'{input_dir_path}/parsed_pdbs.jsonl',
@@ -22,7 +30,7 @@ def create_protein_mpnn_run_command(
     }
 
     if seed:
-        protein_mpnn_args['seed'] = int(seed)
+        protein_mpnn_args['seed'] = str(int(seed))
 
     py_file_path = f'{protein_mpnn_install_dir_path}/protein_mpnn_run.py'
 
@@ -34,4 +42,9 @@ def create_protein_mpnn_run_command(
         cmd.append(f'--{arg_name}')
         cmd.append(arg_value)
 
-    return ' '.join(cmd)
+    return cmd
+
+
+def as_shell_string(cmd : List[str]) -> str:
+    """Join a command list into a string with each argument quoted for the shell."""
+    return shlex.join(cmd)